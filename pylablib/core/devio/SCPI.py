@@ -561,6 +561,42 @@ class SCPIDevice(comm_backend.ICommBackendWrapper):
         if flush_term:
             self.flush(one_line=True)
         return (header+data) if include_header else data
+    def read_binary_array_data_into(self, out, timeout=None, flush_term=True):
+        """
+        Read a binary data from the device directly into a writable buffer `out` (e.g., a contiguous numpy array).
+
+        The data assumes the same standard binary transfer header as :meth:`read_binary_array_data`;
+        the declared data length must be equal to the buffer size in bytes.
+        If the backend supports reading into a buffer (e.g., ``"network"`` backend), the data is received directly into `out` without intermediate copies;
+        otherwise, it is read as a whole and then copied.
+        If ``flush_term==True``, flush the following line to skip terminator characters after the binary data, which are added by some devices.
+        If the declared length does not agree with the buffer size, the data block is skipped (along with the terminator, if ``flush_term==True``),
+        and :exc:`ValueError` is raised (same as in :meth:`parse_array_data`); skipping any following data in the same reply is left to the caller.
+        `timeout` overrides the default value.
+        Note that the direct read into the buffer bypasses the fail-safe retry and recovery logic (a partially received data block can not be re-read),
+        so the backend errors during it are raised immediately.
+        Return `out`.
+        """
+        buf=memoryview(out).cast("B")
+        header=self._read_retry(raw=True,size=2,timeout=timeout)
+        if header[:1]!=b"#":
+            raise DeviceError("malformatted data")
+        len_size=int(header[1:2])
+        length=int(self._read_retry(raw=True,size=len_size,timeout=timeout))
+        if length!=len(buf):
+            self._read_retry(raw=True,size=length,timeout=timeout)
+            if flush_term:
+                self.flush(one_line=True)
+            raise ValueError("data length {} doesn't agree with the buffer size {}".format(length,len(buf)))
+        if hasattr(self.instr,"read_into"):
+            timeout=self._operation_timeout if timeout is None else timeout
+            with self.instr.locking(timeout=timeout), self.instr.using_timeout(timeout):
+                self.instr.read_into(buf)
+        else:
+            buf[:]=self._read_retry(raw=True,size=length,timeout=timeout)
+        if flush_term:
+            self.flush(one_line=True)
+        return out
     @staticmethod
     def parse_array_data(data, fmt, include_header=False):
         """
@@ -1115,6 +1115,19 @@ class NetworkDeviceBackend(IDeviceCommBackend):
         return self._to_datatype(result)
     @logerror
     @reraise
+    def read_into(self, buffer):
+        """
+        Read data from the device directly into a writable buffer `buffer` (e.g., ``bytearray`` or a contiguous numpy array).
+
+        The number of read bytes is equal to the buffer size (usual timeout applies). Return the number of read bytes.
+        """
+        nread=self.socket.recv_fixedlen_into(buffer)
+        self.cooldown("read")
+        if logger:
+            self._log("read",bytes(memoryview(buffer).cast("B")))  # log a copy, since the buffer is usually reused
+        return nread
+    @logerror
+    @reraise
     def read_multichar_term(self, term, remove_term=True, timeout=None):
         """
         Read a single line with multiple possible terminators.
@@ -137,7 +137,7 @@ class DataFormat:
                 data=[e.strip() for e in re.split(br"\s*,\s*|\s+",data)]
             else:
                 data=[e.strip() for e in re.split(r"\s*,\s*|\s+",data)]
-            return np.array([float(e) for e in data if e])
+            return np.array([e for e in data if e],dtype="float")
         else:
             return np.require(np.frombuffer(data,dtype=self.to_desc("numpy")),requirements="W")
     def convert_to_str(self, data, ascii_format=".5f"):
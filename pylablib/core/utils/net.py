@@ -191,6 +191,17 @@ class ClientSocket:
         if len(recvd)==0:
             raise SocketError("connection closed while receiving")
         return recvd
+    def _recv_into_wait(self, buf):
+        sock_func=lambda: self.sock.recv_into(buf)
+        try:
+            nrecvd=_wait_sock_func(sock_func,self.timeout,self.wait_callback)
+        except socket.timeout:
+            raise SocketTimeout("timeout while receiving")
+        except ConnectionResetError:
+            raise SocketError("connection closed while receiving")
+        if nrecvd==0:
+            raise SocketError("connection closed while receiving")
+        return nrecvd
     def _send_wait(self, msg):
         sock_func=lambda: self.sock.send(py3.as_builtin_bytes(msg))
         return _wait_sock_func(sock_func,self.timeout,self.wait_callback)
@@ -204,6 +215,17 @@ class ClientSocket:
             lread+=len(chunks[-1])
         buf=b"".join(chunks)
         return py3.as_datatype(buf,self.datatype)
+    def recv_fixedlen_into(self, buf):
+        """
+        Receive fixed-length message directly into a writable buffer `buf` (e.g., ``bytearray`` or a contiguous numpy array).
+
+        The message length is equal to the buffer size in bytes. Return the number of received bytes.
+        """
+        view=memoryview(buf).cast("B")
+        lread=0
+        while lread<len(view):
+            lread+=self._recv_into_wait(view[lread:])
+        return lread
     def recv_delimiter(self, delim, lmax=None, chunk_l=1024, strict=False):
         """
         Receive a single message ending with a delimiter `delim` (can be several characters, or list several possible delimiter strings).
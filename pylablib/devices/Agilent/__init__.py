@@ -1 +1 @@
-from .base import ITektronixScope, DPO2000, TDS2000, TektronixError
\ No newline at end of file
+from .base import IAgilentScope, DSO2000, MSO2000, AgilentError
\ No newline at end of file
@@ -4,12 +4,17 @@ from ...core.devio import SCPI, data_format, interface, comm_backend
 from ...core.utils import funcargparse, general
 
 import collections
+import socket
+import threading
+import queue
 
 
 class AgilentError(comm_backend.DeviceError):
     """Generic Agilent devices error"""
 class AgilentBackendError(AgilentError,comm_backend.DeviceBackendError):
     """Generic Agilent backend communication error"""
+class AgilentDataLengthError(AgilentError):
+    """Received sweep data length does not agree with the preamble"""
 
 def muxchannel(*args, **kwargs):
     """Multiplex the function over its channel argument"""
@@ -18,14 +23,108 @@ def muxchannel(*args, **kwargs):
     def ch_func(self, *_, **__):
         return list(self._main_channels_idx)
     return general.muxcall("channel",special_args={"all":ch_func},mux_argnames=kwargs.get("mux_argnames",None),return_kind=kwargs.get("return_kind","list"),allow_partial=True)
+
+
+NBError=ImportError
+try:
+    import numba as nb
+    NBError=nb.errors.NumbaError
+    @nb.njit(cache=True,nogil=True)
+    def _parse_ascii_numba(buf, out):
+        """
+        Parse comma-separated ASCII numbers from the ``uint8`` array `buf` into the preallocated array `out`.
+
+        Whitespace also separates values, and empty values are skipped (same as in :meth:`.DataFormat.convert_from_str`). Return the total number of values (values which do not fit into `out` are counted, but not stored),
+        or -1 if any value can not be parsed as a plain decimal number.
+        """
+        l=len(buf)
+        n=0
+        i=0
+        while i<l:
+            c=buf[i]
+            if c==44 or c==32 or c==9 or c==10 or c==13: # separators and whitespace
+                i+=1
+                continue
+            sign=1.
+            if c==45:
+                sign=-1.
+                i+=1
+            elif c==43:
+                i+=1
+            mant=0.
+            exp=0
+            ndig=0
+            while i<l and buf[i]>=48 and buf[i]<=57:
+                mant=mant*10.+(buf[i]-48)
+                ndig+=1
+                i+=1
+            if i<l and buf[i]==46:
+                i+=1
+                while i<l and buf[i]>=48 and buf[i]<=57:
+                    mant=mant*10.+(buf[i]-48)
+                    exp-=1
+                    ndig+=1
+                    i+=1
+            if ndig==0:
+                return -1
+            if i<l and (buf[i]==69 or buf[i]==101):
+                i+=1
+                esign=1
+                if i<l and buf[i]==45:
+                    esign=-1
+                    i+=1
+                elif i<l and buf[i]==43:
+                    i+=1
+                e=0
+                edig=0
+                while i<l and buf[i]>=48 and buf[i]<=57:
+                    e=e*10+(buf[i]-48)
+                    edig+=1
+                    i+=1
+                if edig==0:
+                    return -1
+                exp+=esign*e
+            if i<l and not (buf[i]==44 or buf[i]==32 or buf[i]==9 or buf[i]==10 or buf[i]==13): # trailing characters after the number
+                return -1
+            if n<len(out):
+                out[n]=sign*(mant/10.**(-exp) if exp<0 else mant*10.**exp)
+            n+=1
+        return n
+except NBError:
+    _parse_ascii_numba=None
+
+def _parse_ascii_data(data, npts=None):
+    """
+    Parse comma-separated ASCII waveform data (without the block header) into a float32 array.
+
+    `npts` is the expected number of points (if ``None``, determined from the number of separators); it only defines the initial buffer size.
+    Use Numba if it is available; otherwise, or if the data contains values which it can not parse (e.g., ``nan``), use the generic ASCII conversion,
+    which raises :exc:`ValueError` on invalid values.
+    """
+    if _parse_ascii_numba is not None:
+        buf=np.frombuffer(data,dtype="u1")
+        out=np.empty(data.count(b",")+1 if npts is None else npts,dtype=np.float32)
+        n=_parse_ascii_numba(buf,out)
+        if n>len(out):
+            out=np.empty(n,dtype=np.float32)
+            n=_parse_ascii_numba(buf,out)
+        if n>=0:
+            return out[:n]
+    return data_format.DataFormat.from_desc("ascii").convert_from_str(data).astype(np.float32)
+
 TTriggerParameters=collections.namedtuple("TTriggerParameters",["source","level","coupling","slope"])
 class IAgilentScope(SCPI.SCPIDevice):
     """
     Generic Agilent oscilloscope.
+
+    Setter methods read back and return the actually set value.
+    This can be disabled by passing ``verify=False`` (or setting ``_verify_set`` attribute to ``False`` for all setters), in which case the requested value is returned;
+    it halves the number of requests, which speeds up configuring many parameters.
     
     Args:
         addr: device address; usually a VISA address string such as ``"USB0::0x0699::0x0364::C000000::INSTR"``
         nchannels: can specify number of channels on the oscilloscope; by default, autodetect number of channels (might take several seconds on connection)
+        tcp_nodelay: if ``True`` and the device is connected via network, disable Nagle's algorithm on the connection, which reduces latency of short commands
     """
     _wfmpre_comm="WAV:PRE"  # command used to obtain waveform preamble
     _trig_comm="TRIG"  # command used to set up trigger
@@ -39,33 +138,142 @@ class IAgilentScope(SCPI.SCPIDevice):
     _hor_offset_method="pos_only"
     _hor_pos_mode="real_center"  # mode of :HORIZONTAL:POS command; can be "real_center", if time position of the sample is specified (0 is centered), or "frac" if fraction to the left is specified (50 is centered)
     _default_backend_timeout=10.
+    _default_sync_mode="opc"  # default method of waiting for acquisition completion (see :meth:`wait_for_grabbing`)
+    _default_poll_interval=10E-3  # default acquisition state polling period for ``"poll"`` sync mode
+    _verify_set=True  # default value of `verify` argument for setters; if ``True``, read back the set value from the device
     Error=AgilentError
     ReraiseError=AgilentBackendError
-    def __init__(self, addr, nchannels="auto"):
+    _tcp_buffer_size=None  # socket buffer size for raw network connections; ``None`` keeps the system default (on Linux, setting it disables the buffer autotuning)
+    # preamble fields (in the order they are returned by the device) and the corresponding parsers
+    _wfmpre_parsers=[("fmt",int),("type",int),("pts",int),("count",int),("xincr",float),("xzero",float),("ptoff",int),("ymult",float),("yzero",float),("yoff",float)]
+    _wfmpre_formats={0:"BYTE",1:"WORD",3:"ASCII",4:"ASCII"}  # preamble format codes
+    _wfmpre_types=("NORM","PEAK","AVER","HRES")  # preamble acquisition type codes
+    def __init__(self, addr, nchannels="auto", tcp_nodelay=True):
+        self._pipeline=None
         SCPI.SCPIDevice.__init__(self,addr)
+        self._tcp_nodelay=tcp_nodelay
+        self._setup_tcp_connection()
         if self._main_channels_idx=="specify":
             if nchannels=="auto":
                 nchannels=self._detect_main_channels_number()
             self._main_channels_idx=list(range(1,nchannels+1))
         self._main_channels=[(i,"chan{}".format(i)) for i in self._main_channels_idx]
+        self._main_channel_names=tuple("CHAN{}".format(i) for i in self._main_channels_idx)
+        self._all_channel_names=self._main_channel_names+tuple(self._aux_channels)
+        self._ch_cmds={name:self._build_channel_commands(name) for name in self._main_channel_names}
         self._add_parameter_class(interface.EnumParameterClass("input_channel",self._main_channels,value_case="upper",match_prefix=True))
         self._add_parameter_class(interface.EnumParameterClass("channel",self._main_channels+self._aux_channels,value_case="upper",match_prefix=True))
         self.default_data_fmt="<i1"
+        self._wfmpre_cache={}
+        self._current_data_fmt=None  # last known data transfer format; used to skip format checks in :meth:`read_multiple_sweeps`
+        self._cached_span=None  # last known horizontal span; used to convert horizontal position without re-requesting it
+        self._raw_buffers={}  # preallocated raw data buffers for binary sweeps, reused between reads
         self._add_info_variable("channels_number",self.get_channels_number)
         self._add_info_variable("channels",self.get_channels)
-        self._add_settings_variable("edge_trigger/source",self.get_edge_trigger_source,self.set_edge_trigger_source)
-        self._add_settings_variable("edge_trigger/coupling",self.get_edge_trigger_coupling,self.set_edge_trigger_coupling)
-        self._add_settings_variable("edge_trigger/slope",self.get_edge_trigger_slope,self.set_edge_trigger_slope)
-        self._add_settings_variable("edge_trigger/level",self.get_trigger_level,self.set_trigger_level)
-        self._add_settings_variable("horizontal_span",self.get_horizontal_span,self.set_horizontal_span)
-        self._add_settings_variable("horizontal_offset",self.get_horizontal_offset,self.set_horizontal_offset)
-        self._add_settings_variable("enabled",self.is_channel_enabled,self.enable_channel,mux=(self._main_channels_idx,))
-        self._add_settings_variable("vertical_span",self.get_vertical_span,self.set_vertical_span,mux=(self._main_channels_idx,))
-        self._add_settings_variable("vertical_position",self.get_vertical_position,self.set_vertical_position,mux=(self._main_channels_idx,))
-        self._add_settings_variable("coupling",self.get_coupling,self.set_coupling,mux=(self._main_channels_idx,))
-        self._add_settings_variable("probe_attenuation",self.get_probe_attenuation,self.set_probe_attenuation,mux=(self._main_channels_idx,))
+        self._channel_settings=self._build_channel_settings()
+        self._cmd_snapshot,self._snapshot_fields=self._build_settings_snapshot()
+        self._settings_snapshot=None  # settings snapshot shared by the settings getters within a single :meth:`_get_device_variables` call
+        # standard settings are taken from a single compound query when read together (see :meth:`_get_device_variables`)
+        snap=self._snapshot_getter
+        self._add_settings_variable("edge_trigger/source",snap("edge_trigger/source",self.get_edge_trigger_source),self.set_edge_trigger_source)
+        self._add_settings_variable("edge_trigger/coupling",snap("edge_trigger/coupling",self.get_edge_trigger_coupling),self.set_edge_trigger_coupling)
+        self._add_settings_variable("edge_trigger/slope",snap("edge_trigger/slope",self.get_edge_trigger_slope),self.set_edge_trigger_slope)
+        self._add_settings_variable("edge_trigger/level",snap("edge_trigger/level",self.get_trigger_level),self.set_trigger_level)
+        self._add_settings_variable("horizontal_span",snap("horizontal_span",self.get_horizontal_span),self.set_horizontal_span)
+        self._add_settings_variable("horizontal_offset",snap("horizontal_offset",self.get_horizontal_offset),self.set_horizontal_offset)
+        # per-channel settings are queried for all channels at once (see :meth:`_get_settings_bulk`); setters accept either a list or a dict ``{channel: value}``
+        self._add_settings_variable("enabled",snap("enabled",lambda: self._get_settings_bulk("enabled")),lambda v: self.enable_channel("all",v))
+        self._add_settings_variable("vertical_span",snap("vertical_span",lambda: self._get_settings_bulk("vertical_span")),lambda v: self.set_vertical_span("all",v))
+        self._add_settings_variable("vertical_position",snap("vertical_position",lambda: self._get_settings_bulk("vertical_position")),lambda v: self.set_vertical_position("all",v))
+        self._add_settings_variable("coupling",snap("coupling",lambda: self._get_settings_bulk("coupling")),lambda v: self.set_coupling("all",v))
+        self._add_settings_variable("probe_attenuation",snap("probe_attenuation",lambda: self._get_settings_bulk("probe_attenuation")),lambda v: self.set_probe_attenuation("all",v))
 
+    def _setup_tcp_connection(self):
+        """
+        Set up network connection parameters.
+
+        For raw socket connections (``"network"`` backend), set ``TCP_NODELAY`` option (if enabled) and socket buffer sizes (if ``_tcp_buffer_size`` is not ``None``);
+        for VISA TCPIP resources, set the corresponding ``VI_ATTR_TCPIP_NODELAY`` attribute (if it is supported by the resource).
+        Other connections (e.g., USB) are not affected.
+        """
+        backend=self.instr.get_backend_name()
+        if backend=="network":
+            sock=self.instr.socket.sock
+            if self._tcp_nodelay:
+                sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+            if self._tcp_buffer_size is not None:
+                sock.setsockopt(socket.SOL_SOCKET,socket.SO_SNDBUF,self._tcp_buffer_size)
+                sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,self._tcp_buffer_size)
+        elif backend=="visa" and self._tcp_nodelay:
+            instr=self.instr.instr
+            if str(getattr(instr,"resource_name","")).upper().startswith("TCPIP"):
+                try:
+                    instr.set_visa_attribute(comm_backend.visa.constants.VI_ATTR_TCPIP_NODELAY,comm_backend.visa.constants.VI_TRUE)
+                except Exception:  # pylint: disable=broad-except
+                    pass  # not supported by the resource kind (e.g., VXI-11) or by the VISA implementation
+    def open(self):
+        """Open the backend"""
+        super().open()
+        self._setup_tcp_connection()
+    def close(self):
+        """Close the backend (stop the acquisition pipeline first, if it is running)"""
+        self.stop_pipeline()
+        return super().close()
+    def _build_channel_commands(self, name):
+        """
+        Build the dictionary of per-channel commands for the channel with the given device name (e.g., ``"CHAN1"``).
+
+        Contains set command headers (e.g., ``"scal"``) along with the corresponding queries (e.g., ``"scal?"``).
+        """
+        cmds={"scal":":{}:SCAL".format(name),"offs":":{}:OFFS".format(name),"coup":":{}:COUP".format(name),"disp":":{}:DISP".format(name)}
+        if self._probe_attenuation_comm:
+            cmds["prob"]=":{}:{}".format(name,self._probe_attenuation_comm[0])
+        cmds.update({k+"?":c+"?" for k,c in cmds.items()})
+        return cmds
+    def _build_channel_settings(self):
+        """
+        Build the table of per-channel settings shared by the channel getters, :meth:`_get_settings_bulk`, and :meth:`snapshot_settings`.
+
+        Return dictionary ``{name: (query, data_type, conv)}``, where ``query`` is the query key in the per-channel commands dictionary (see :meth:`_build_channel_commands`),
+        ``data_type`` is the reply data type, and ``conv`` is the conversion function applied to the parsed reply (or ``None``).
+        """
+        settings={"enabled":("disp?","bool",None),
+                "vertical_span":("scal?","float",lambda v: v*10.), # scale is per division (10 division per screen)
+                "vertical_position":("offs?","float",None),
+                "coupling":("coup?","string",lambda v: self._parameters["coupling"].i(v,device=self))}
+        if self._probe_attenuation_comm:
+            settings["probe_attenuation"]=("prob?","float",None if self._probe_attenuation_comm[1]=="att" else lambda v: 1./v)
+        return settings
+    def _convert_channel_setting(self, name, value):
+        """Convert parsed device reply for the per-channel setting `name` into the setting value"""
+        conv=self._channel_settings[name][2]
+        return value if conv is None else conv(value)
+    def _ask_channel_setting(self, channel, name):
+        """Query per-channel setting `name` for the given channel (device channel name, e.g., ``"CHAN1"``)"""
+        query,data_type,_=self._channel_settings[name]
+        return self._convert_channel_setting(name,self.ask(self._ch_cmds[channel][query],data_type))
     def _detect_main_channels_number(self):
+        """
+        Detect the number of main channels.
+
+        First try to query all possible channels in a single compound request and count the valid replies;
+        if the device does not reply to it, probe the channels one by one.
+        """
+        try:
+            self.write(self._cls_comm)
+            reply=self.ask(";".join([":CHAN{}:BWL?".format(ch) for ch in range(1,17)]),timeout=1.)
+            ch=0
+            for r in reply.split(";"):
+                if r.strip() not in {"0","1"}:
+                    break
+                ch+=1
+            self.flush()
+            self.write(self._cls_comm)
+            if ch>0:
+                return ch
+        except self.Error:
+            self.flush()
+            self.write(self._cls_comm)
         ch=1
         while ch<=16:
             if self._is_command_valid(":CHAN{}:BWL?".format(ch+1)):
@@ -73,35 +281,241 @@ class IAgilentScope(SCPI.SCPIDevice):
             else:
                 break
         return ch
+    def write(self, msg, arg=None, arg_type=None, unit=None, bool_selector=None, wait_sync=None, read_echo=False, read_echo_delay=0.):
+        """
+        Send a command.
+
+        Same as :meth:`.SCPIDevice.write`; in addition, if the command can change the sweep preambles (see :meth:`_get_affected_caches`),
+        clear the cached preambles, as well as the cached data format or horizontal span if they are affected.
+        """
+        affected=self._get_affected_caches(msg)
+        if affected:
+            self._invalidate_wfmpre()
+            if "data_fmt" in affected:
+                self._current_data_fmt=None
+            if "span" in affected:
+                self._cached_span=None
+        return super().write(msg,arg=arg,arg_type=arg_type,unit=unit,bool_selector=bool_selector,wait_sync=wait_sync,read_echo=read_echo,read_echo_delay=read_echo_delay)
+    @staticmethod
+    def _get_affected_caches(msg):
+        """
+        Get the set of cached values which can be changed by the commands in the message.
+
+        The set can contain ``"wfmpre"`` (sweep preambles; changed by channel scale, offset, range, or probe attenuation, any timebase or acquisition settings,
+        and waveform points number or data format), ``"span"`` (horizontal span; changed by ``:TIM:SCAL`` or ``:TIM:RANG``),
+        and ``"data_fmt"`` (data transfer format; changed by ``:WAV:FORM``, ``:WAV:UNS``, or ``:WAV:BYT``).
+        Queries do not affect any values.
+        """
+        affected=set()
+        for comm in msg.upper().split(";"):
+            if not comm.strip():
+                continue
+            header=comm.split()[0].lstrip(":").split(":")
+            if header[-1].endswith("?"):
+                continue
+            root,sub=header[0],(header[1] if len(header)>1 else "")
+            if root.startswith("WAV"):
+                if sub[:3] in {"FOR","UNS","BYT"}:
+                    affected|={"wfmpre","data_fmt"}
+                elif sub.startswith("POIN"):
+                    affected.add("wfmpre")
+            elif root.startswith("CHAN"):
+                if sub[:4] in {"SCAL","OFFS","RANG","PROB"}:
+                    affected.add("wfmpre")
+            elif root.startswith("TIM"):
+                affected|={"wfmpre","span"} if sub[:4] in {"SCAL","RANG"} else {"wfmpre"}
+            elif root.startswith("ACQ"):
+                affected.add("wfmpre")
+        return affected
+    def _ask_multi(self, comms, data_type="string"):
+        """
+        Send several queries as a single compound command and return the list of replies.
+
+        `comms` is a list of query commands, which are joined with ``";"``; the reply is split on ``";"`` and parsed.
+        `data_type` is either a single data type applied to all replies, or a list of data types for each query (same as in :meth:`ask`).
+        """
+        if not comms:
+            return []
+        reply=self.ask(";".join(comms)).split(";")
+        if len(reply)!=len(comms):
+            raise self.Error("compound query {} returned {} values instead of {}".format(";".join(comms),len(reply),len(comms)))
+        if not isinstance(data_type,list):
+            data_type=[data_type]*len(comms)
+        return [self._parse_msg(r,dt) for r,dt in zip(reply,data_type)]
+    def _get_settings_bulk(self, name):
+        """
+        Get per-channel setting for all main channels using a single compound query.
+
+        `name` is the setting name (``"enabled"``, ``"vertical_span"``, ``"vertical_position"``, ``"coupling"``, or ``"probe_attenuation"``).
+        Return dictionary ``{channel: value}``.
+        """
+        channels=self._main_channels_idx
+        if name=="probe_attenuation" and not self._probe_attenuation_comm:
+            return {ch:1 for ch in channels}
+        if name not in self._channel_settings:
+            raise ValueError("unrecognized setting: {}".format(name))
+        query,data_type,_=self._channel_settings[name]
+        values=self._ask_multi([self._ch_cmds[n][query] for n in self._main_channel_names],data_type)
+        return {ch:self._convert_channel_setting(name,v) for ch,v in zip(channels,values)}
+    def _build_settings_snapshot(self):
+        """
+        Build the compound query for :meth:`snapshot_settings`.
+
+        Return tuple ``(query, fields)``, where ``fields`` is the list of tuples ``(name, channel, data_type, conv)`` describing the reply fields:
+        setting name, channel index (``None`` for channel-independent settings), reply data type, and conversion function (or ``None``).
+        """
+        trig=":"+self._trig_comm.lstrip(":")
+        fields=[("edge_trigger/source",None,trig+":EDGE:SOUR?","string",lambda v: self._parameters["channel"].i(v)),
+                ("edge_trigger/coupling",None,trig+":EDGE:COUPL?","string",lambda v: self._parameters["trigger_coupling"].i(v)),
+                ("edge_trigger/slope",None,trig+":EDGE:SLOPE?","string",lambda v: self._parameters["slope"].i(v)),
+                ("edge_trigger/level",None,trig+":LEVEL?","float",None),
+                ("horizontal_span",None,":TIM:SCAL?","float",lambda v: v*10.), # scale is per division (10 division per screen)
+                ("horizontal_offset",None,":TIM:POS?","float",None)]
+        for idx,ch_name in zip(self._main_channels_idx,self._main_channel_names):
+            fields+=[(name,idx,self._ch_cmds[ch_name][query],data_type,conv) for name,(query,data_type,conv) in self._channel_settings.items()]
+        return ";".join(f[2] for f in fields),[(f[0],f[1],f[3],f[4]) for f in fields]
+    def snapshot_settings(self):
+        """
+        Get all the standard device settings using a single compound query.
+
+        Return dictionary with the same structure as :meth:`get_settings`: ``{name: value}`` for channel-independent settings,
+        and ``{name: {channel: value}}`` for per-channel settings.
+        """
+        reply=self.ask(self._cmd_snapshot).split(";")
+        if len(reply)!=len(self._snapshot_fields):
+            raise self.Error("settings snapshot query returned {} values instead of {}".format(len(reply),len(self._snapshot_fields)))
+        settings={}
+        for (name,ch,data_type,conv),r in zip(self._snapshot_fields,reply):
+            value=self._parse_msg(r,data_type)
+            if conv is not None:
+                value=conv(value)
+            if ch is None:
+                settings[name]=value
+            else:
+                settings.setdefault(name,{})[ch]=value
+        if not self._probe_attenuation_comm:
+            settings["probe_attenuation"]={ch:1 for ch in self._main_channels_idx}
+        self._cached_span=settings["horizontal_span"]
+        settings["horizontal_offset"]=self._from_horizontal_pos(settings["horizontal_offset"])
+        return settings
+    def _snapshot_getter(self, name, getter):
+        """Wrap settings `getter` to take the value of the setting `name` from the settings snapshot, if it is active (see :meth:`_get_device_variables`)"""
+        def get():
+            if self._settings_snapshot is not None and not self._settings_snapshot:
+                try:
+                    self._settings_snapshot.update(self.snapshot_settings())
+                except self.Error:
+                    self._settings_snapshot=None
+            if self._settings_snapshot is None:
+                return getter()
+            return self._settings_snapshot[name]
+        return get
+    def _get_device_variables(self, kinds, include=0):
+        """
+        Get dict ``{name: value}`` containing all the device variables of the given kinds.
+
+        Standard settings are acquired using a single compound query (see :meth:`snapshot_settings`), which is only sent if any of them are requested;
+        if the snapshot query fails, they are requested one by one.
+        """
+        if "settings" not in kinds or self._settings_snapshot is not None:
+            return super()._get_device_variables(kinds,include=include)
+        self._settings_snapshot={}  # filled on the first snapshot variable request
+        try:
+            return super()._get_device_variables(kinds,include=include)
+        finally:
+            self._settings_snapshot=None
+    def _maybe_readback(self, getter, value, verify=None, parameter=None):
+        """
+        Return setter result.
+
+        If `verify` is ``True`` (or if it is ``None`` and ``_verify_set`` attribute is ``True``), call `getter` to read the actual value back;
+        otherwise, return the requested `value`, converting it from the device value using the parameter class `parameter` if it is specified.
+        Readback is also skipped while applying settings (see :meth:`.SCPIDevice.apply_settings`), since the result is discarded anyway.
+        """
+        if self._need_readback(verify):
+            return getter()
+        return self._parameters[parameter].i(value) if parameter else value
+    def _need_readback(self, verify=None):
+        """Check if the setter result needs to be read back from the device (see :meth:`_maybe_readback`)"""
+        if verify is None:
+            return self._verify_set and self._setter_echo
+        return verify
+    def write_then_ask(self, write_cmd, write_val, read_cmd, read_kind="string", write_type=None):
+        """
+        Send a command and a query as a single compound message and return the parsed reply.
+
+        `write_cmd`, `write_val` and `write_type` are the same as `msg`, `arg` and `arg_type` in :meth:`write`,
+        while `read_cmd` and `read_kind` are the same as `msg` and `data_type` in :meth:`ask`.
+        Takes a single round-trip instead of two for separate :meth:`write` and :meth:`ask` calls.
+        """
+        return self.ask(self._compose_msg(write_cmd,write_val,write_type)+";"+read_cmd,read_kind)
     def get_channels_number(self):
         """Get the number of channels"""
         return len(self._main_channels_idx)
     def get_channels(self, only_main=False):
         """Get the list of all input channels (if ``only_main==True``) or all available channels (if ``only_main==False``)"""
-        channels=["CHAN{}".format(i) for i in self._main_channels_idx]
-        return channels if only_main else channels+self._aux_channels
+        return list(self._main_channel_names) if only_main else list(self._all_channel_names)
     @interface.use_parameters
     def normalize_channel_name(self, channel):
         """Normalize channel name as represented by the oscilloscope"""
         return channel
-    def grab_single(self, wait=True, software_trigger=False, wait_timeout=None):
+    def grab_single(self, wait=True, software_trigger=False, wait_timeout=None, poll_interval=None, sync_mode=None):
         """
         Set single waveform grabbing and wait for acquisition.
 
         If ``wait==True``, wait until the acquisition is complete; otherwise, return immediately.
         if ``software_trigger==True``, send the software trigger after setup (i.e., the device triggers immediately regardless of the input).
+        `poll_interval` and `sync_mode` are passed to :meth:`wait_for_grabbing`.
         """
         self.write(":SING") #Starts single acquisition
         if software_trigger:
             self.sleep(self._software_trigger_delay)
             self.force_trigger()
         if wait:
-            self.wait_sync(timeout=wait_timeout)
-    def wait_for_grabbing(self, timeout=None):
-        """Wait until the acquisition is complete"""
-        self.wait_sync(timeout=timeout)
+            self.wait_for_grabbing(timeout=wait_timeout,poll_interval=poll_interval,sync_mode=sync_mode)
+    def _opc_wait(self, timeout=None):
+        """
+        Wait until the pending operations are complete using a single blocking ``*WAI;*OPC?`` query.
+
+        `timeout` overrides the default sync timeout.
+        """
+        timeout=self._wait_sync_timeout if timeout is None else timeout
+        self._ask_retry(self._wait_dev_comm+";"+self._wait_sync_comm,raw=True,timeout=timeout,wait_callback=self._wait_callback,retry=True)
+    def wait_for_grabbing(self, timeout=None, poll_interval=None, sync_mode=None):
+        """
+        Wait until the acquisition is complete.
+
+        `sync_mode` defines the waiting method: ``"opc"`` (block on a single ``*OPC?`` query reply, see :meth:`.SCPIDevice.wait_sync`),
+        ``"wai"`` (same, but with ``*WAI`` command preceding the query), or ``"poll"`` (poll the acquisition state using :meth:`is_running`).
+        The first two methods return as soon as the device reports completion without extra requests, so they are preferable if the device supports them;
+        polling is a fallback for devices which reply to ``*OPC?`` too early, and it does not block the communication while waiting.
+        If `sync_mode` is ``None``, use the class default (``"opc"``).
+        `poll_interval` specifies the polling period (in seconds) for the ``"poll"`` mode; if ``None``, use the class default (10 ms).
+        """
+        if sync_mode is None:
+            sync_mode=self._default_sync_mode
+        funcargparse.check_parameter_range(sync_mode,"sync_mode",["opc","wai","poll"])
+        if sync_mode=="opc":
+            self.wait_sync(timeout=timeout)
+        elif sync_mode=="wai":
+            self._opc_wait(timeout=timeout)
+        else:
+            poll_interval=self._default_poll_interval if poll_interval is None else poll_interval
+            timeout=self._wait_sync_timeout if timeout is None else timeout
+            ctd=general.Countdown(timeout)
+            while self.is_running():
+                if ctd.passed():
+                    raise AgilentError("timeout while waiting for the acquisition to complete")
+                self.sleep(poll_interval)
+    def reset(self):
+        """Reset the device (``"*RST"`` command) and clear the cached preambles and settings"""
+        self._invalidate_wfmpre()
+        self._current_data_fmt=None
+        self._cached_span=None
+        return super().reset()
     def grab_continuous(self, enable=True):
         """Start or stop continuous grabbing"""
+        self._invalidate_wfmpre()  # number of available points can depend on the acquisition state
         if enable:
             self.write(":RUN")
         else:
@@ -120,6 +534,14 @@ class IAgilentScope(SCPI.SCPIDevice):
         To check if the trigger has been triggered, use :meth:`get_trigger_state`.
         """
         return self.ask(":ACQ:COMP?")!="100"
+    def is_running(self):
+        """
+        Check if the acquisition is running, i.e., the oscilloscope is waiting for a trigger or recording data.
+
+        Use the Run bit (bit 3) of the operation status condition register (``:OPER:COND?``), which is cleared once a single acquisition is complete or the acquisition is stopped.
+        Unlike ``*OPC?``, the query returns immediately, so it is suitable for polling.
+        """
+        return bool(self.ask(":OPER:COND?","int")&0x08)
     
     # TODO: set trigger kind (edge, etc.)
     @interface.use_parameters(_returns="channel")
@@ -131,14 +553,14 @@ class IAgilentScope(SCPI.SCPIDevice):
         """
         return self.ask(self._trig_comm+":EDGE:SOUR?")
     @interface.use_parameters
-    def set_edge_trigger_source(self, channel):
+    def set_edge_trigger_source(self, channel, verify=None):
         """
         Get edge trigger source.
 
         Can be an integer indicating channel number or a name of a special channel.
         """
         self.write(self._trig_comm+":EDGE:SOURCE",channel)
-        return self.get_edge_trigger_source()
+        return self._maybe_readback(self.get_edge_trigger_source,channel,verify,parameter="channel")
     _p_coupling=interface.EnumParameterClass("coupling",["ac","dc"],value_case="upper")
     _p_trigger_coupling=interface.EnumParameterClass("trigger_coupling",["ac","dc","lfr"],value_case="upper",match_prefix=True)
     _p_slope=interface.EnumParameterClass("slope",["neg","pos","eith","alt"],value_case="upper",match_prefix=True)
@@ -147,41 +569,43 @@ class IAgilentScope(SCPI.SCPIDevice):
         """Get edge trigger coupling (``"ac"``, ``"dc"`` or ``"lfr"``)"""
         return self.ask(self._trig_comm+":EDGE:COUPL?")
     @interface.use_parameters(coupling="trigger_coupling")
-    def set_edge_trigger_coupling(self, coupling):
+    def set_edge_trigger_coupling(self, coupling, verify=None):
         """Set edge trigger coupling (``"ac"``, ``"dc"`` or ``"lfr"``)"""
         self.write(self._trig_comm+":EDGE:COUPL",coupling)
-        return self.get_edge_trigger_coupling()
+        return self._maybe_readback(self.get_edge_trigger_coupling,coupling,verify,parameter="trigger_coupling")
     @interface.use_parameters(_returns="slope")
     def get_edge_trigger_slope(self):
         """Get edge trigger slope (``"neg"``, ``"pos"``, ``"eith"`` or ``"alt"``)"""
         return self.ask(self._trig_comm+":EDGE:SLOPE?")
     @interface.use_parameters
-    def set_edge_trigger_slope(self, slope):
+    def set_edge_trigger_slope(self, slope, verify=None):
         """Set edge trigger slope ``"neg"``, ``"pos"``, ``"eith"`` or ``"alt"``)"""
         self.write(self._trig_comm+":EDGE:SLOPE",slope)
-        return self.get_edge_trigger_slope()
+        return self._maybe_readback(self.get_edge_trigger_slope,slope,verify,parameter="slope")
     def get_trigger_level(self):
         """Get edge trigger level (in Volts)"""
         return self.ask(self._trig_comm+":LEVEL?","float")
-    def set_trigger_level(self, level):
+    def set_trigger_level(self, level, verify=None):
         """Set edge trigger level (in Volts)"""
         self.write(self._trig_comm+":LEVEL",level)
-        return self.get_trigger_level()
+        return self._maybe_readback(self.get_trigger_level,level,verify)
     def _get_edge_trigger_params(self):
-        return TTriggerParameters(self.get_edge_trigger_source(), self.get_trigger_level(), self.get_edge_trigger_coupling(), self.get_edge_trigger_slope())
-    @interface.use_parameters(source="channel")
-    def setup_edge_trigger(self, source, level, coupling="dc", slope="pos"):
+        comm=":"+self._trig_comm.lstrip(":")
+        source,level,coupling,slope=self._ask_multi([comm+":EDGE:SOUR?",comm+":LEVEL?",comm+":EDGE:COUPL?",comm+":EDGE:SLOPE?"],["string","float","string","string"])
+        return TTriggerParameters(self._parameters["channel"].i(source), level, self._parameters["trigger_coupling"].i(coupling), self._parameters["slope"].i(slope))
+    @interface.use_parameters(source="channel",coupling="trigger_coupling")
+    def setup_edge_trigger(self, source, level, coupling="dc", slope="pos", verify=None):
         """
         Setup edge trigger.
 
         Set source, level, coupling and slope (see corresponding methods for details).
+        All the parameters are sent in a single compound command, and read back using a single compound query.
         """
-        self.write(self._trig_comm+":EDGE:SOURCE",source)
-        self.write(self._trig_comm+":EDGE:COUPL",coupling)
-        self.write(self._trig_comm+":EDGE:SLOPE",slope)
-        self.write(self._trig_comm+":LEVEL",level)
-        self.write(self._trig_comm+":MODE","EDGE")
-        return self._get_edge_trigger_params()
+        comm=":"+self._trig_comm.lstrip(":")
+        self.write(";".join([self._compose_msg(comm+":EDGE:SOURCE",source),self._compose_msg(comm+":EDGE:COUPL",coupling),
+                self._compose_msg(comm+":EDGE:SLOPE",slope),self._compose_msg(comm+":LEVEL",level),comm+":MODE EDGE"]))
+        return self._maybe_readback(self._get_edge_trigger_params,
+                TTriggerParameters(self._parameters["channel"].i(source),level,self._parameters["trigger_coupling"].i(coupling),self._parameters["slope"].i(slope)),verify)
     _p_trigger_mode=interface.EnumParameterClass("trigger_sweep",["auto","norm"],value_case="upper",match_prefix=True)
     @interface.use_parameters(_returns="trigger_sweep")
     def get_trigger_mode(self):
@@ -192,14 +616,14 @@ class IAgilentScope(SCPI.SCPIDevice):
         """
         return self.ask(self._trig_comm+":SWE?")
     @interface.use_parameters
-    def set_trigger_mode(self, trigger_mode="auto"):
+    def set_trigger_mode(self, trigger_mode="auto", verify=None):
         """
         Set trigger mode.
 
         Can be either ``"auto"`` or ``"norm"``.
         """
         self.write(self._trig_comm+":SWE",trigger_mode)
-        return self.get_trigger_mode()
+        return self._maybe_readback(self.get_trigger_mode,trigger_mode,verify)
     
     # _p_trigger_state=interface.EnumParameterClass("trigger_state",[("armed","arm"),"ready",("trigger","trig"),"auto",("save","sav"),"scan"],value_case="upper",match_prefix=True)
     # @interface.use_parameters(_returns="trigger_state")
@@ -218,22 +642,25 @@ class IAgilentScope(SCPI.SCPIDevice):
 
     def get_horizontal_span(self):
         """Get horizontal span (in seconds)"""
-        return self.ask(":TIM:SCAL?","float")*10. # scale is per division (10 division per screen)
-    def set_horizontal_span(self, span):
+        self._cached_span=self.ask(":TIM:SCAL?","float")*10. # scale is per division (10 division per screen)
+        return self._cached_span
+    def set_horizontal_span(self, span, verify=None):
         """Set horizontal span (in seconds)"""
+        self._invalidate_wfmpre()
+        self._cached_span=None # the actual span can differ from the requested one; it gets updated on the next request
         self.write("TIM:SCAL",span/10.,"float") # scale is per division (10 division per screen)
-        return self.get_horizontal_span()
+        return self._maybe_readback(self.get_horizontal_span,span,verify)
     def _to_horizontal_pos(self, center_time):
         if self._hor_pos_mode=="real_center":
             return center_time
-        span=self.get_horizontal_span()
+        span=self._cached_span if self._cached_span is not None else self.get_horizontal_span()
         rel_offset=(center_time/span*100)+50
         rel_offset=min(max(rel_offset,0),100)
         return rel_offset
     def _from_horizontal_pos(self, hor_pos):
         if self._hor_pos_mode=="real_center":
             return hor_pos
-        span=self.get_horizontal_span()
+        span=self._cached_span if self._cached_span is not None else self.get_horizontal_span()
         return (hor_pos/100.-.5)*span
     def get_horizontal_offset(self):
         """Get horizontal offset (position of the center of the sweep; in seconds)"""
@@ -241,46 +668,59 @@ class IAgilentScope(SCPI.SCPIDevice):
     # TODO Handle timebase reference position. At the moment center is expected.
     #_p_timebase_reference=interface.EnumParameterClass("timebase_reference",["left",("center","cent"),("right","right")],value_case="upper",match_prefix=True)
     #@interface.use_parameters(reference="timebase_reference")
-    def set_horizontal_offset(self, offset=0.):
+    def set_horizontal_offset(self, offset=0., verify=None):
         """Set horizontal offset (position of the center of the sweep; in seconds)"""
+        self._invalidate_wfmpre()
         #self.write(":TIM:REF", reference)
         self.write(":TIM:POS", self._to_horizontal_pos(offset),"float")
-        return self.get_horizontal_offset()
+        return self._maybe_readback(self.get_horizontal_offset,offset,verify)
     @muxchannel
     @interface.use_parameters(channel="input_channel")
     def get_vertical_span(self, channel):
         """Get channel vertical span (in V)"""
-        return self.ask(":{}:SCAL?".format(channel),"float")*10. # scale is per division (10 division per screen)
+        return self._ask_channel_setting(channel,"vertical_span")
     @muxchannel(mux_argnames="span")
     @interface.use_parameters(channel="input_channel")
-    def set_vertical_span(self, channel, span):
+    def set_vertical_span(self, channel, span, verify=None):
         """Set channel vertical span (in V)"""
-        self.write(":{}:SCAL".format(channel),span/10.,"float") # scale is per division (10 division per screen)
-        return self._wip.get_vertical_span(channel)
+        self._invalidate_wfmpre()
+        cmds=self._ch_cmds[channel]
+        if self._need_readback(verify):
+            return self._convert_channel_setting("vertical_span",self.write_then_ask(cmds["scal"],span/10.,cmds["scal?"],"float",write_type="float")) # scale is per division (10 division per screen)
+        self.write(cmds["scal"],span/10.,"float")
+        return span
     @muxchannel
     @interface.use_parameters(channel="input_channel")
     def get_vertical_position(self, channel):
         """Get channel vertical position (offset of the zero volt line; in V)"""
-        return self.ask(":{}::OFFS?".format(channel),"float") # offset is in divisions (10 division per screen)
+        return self._ask_channel_setting(channel,"vertical_position")
     @muxchannel(mux_argnames="position")
     @interface.use_parameters(channel="input_channel")
-    def set_vertical_position(self, channel, position):
+    def set_vertical_position(self, channel, position, verify=None):
         """Set channel vertical position (offset of the zero volt line; in V)"""
-        self.write(":{}::OFFS".format(channel),position,"float")
-        return self._wip.get_vertical_position(channel)
+        self._invalidate_wfmpre()
+        cmds=self._ch_cmds[channel]
+        if self._need_readback(verify):
+            return self.write_then_ask(cmds["offs"],position,cmds["offs?"],"float",write_type="float")
+        self.write(cmds["offs"],position,"float")
+        return position
     
 
     @muxchannel
     @interface.use_parameters(channel="input_channel")
     def is_channel_enabled(self, channel):
         """Check if channel is enabled"""
-        return self.ask(":{}:DISP?".format(channel),"bool")
+        return self._ask_channel_setting(channel,"enabled")
     @muxchannel(mux_argnames="enabled")
     @interface.use_parameters(channel="input_channel")
-    def enable_channel(self, channel, enabled=True):
+    def enable_channel(self, channel, enabled=True, verify=None):
         """Enable or disable given channel"""
-        self.write(":{}:DISP".format(channel),enabled,"bool")
-        return self._wip.is_channel_enabled(channel)
+        self._invalidate_wfmpre()
+        cmds=self._ch_cmds[channel]
+        if self._need_readback(verify):
+            return self.write_then_ask(cmds["disp"],enabled,cmds["disp?"],"bool",write_type="bool")
+        self.write(cmds["disp"],enabled,"bool")
+        return bool(enabled)
     @interface.use_parameters(_returns="input_channel")
     def get_selected_channel(self):
         """
@@ -290,14 +730,14 @@ class IAgilentScope(SCPI.SCPIDevice):
         """
         return self.ask(":WAV:SOUR?").strip()
     @interface.use_parameters(channel="input_channel")
-    def select_channel(self, channel):
+    def select_channel(self, channel, verify=None):
         """
         Select a channel to read data.
 
         Doesn't need to be called explicitly, if :meth:`read_multiple_sweeps` or :meth:`read_sweep` are used.
         """
         self.write(":WAV:SOUR {}".format(channel))
-        return self.get_selected_channel()
+        return self._maybe_readback(self.get_selected_channel,channel,verify,parameter="input_channel")
     def _normalize_channel(self, channel):
         return self._parameters["channel"](channel)
     def _get_channel(self, channel):
@@ -309,7 +749,7 @@ class IAgilentScope(SCPI.SCPIDevice):
         """Select a new channel if specified"""
         if channel is not None:
             self.select_channel(channel)
-    @interface.use_parameters(channel="input_channel",_returns="coupling")
+    @interface.use_parameters(channel="input_channel")
     @muxchannel
     def get_coupling(self, channel):
         """
@@ -317,34 +757,42 @@ class IAgilentScope(SCPI.SCPIDevice):
 
         Can be ``"ac"`` or ``"dc"``.
         """
-        return self.ask(":{}:COUP?".format(channel))
+        return self._ask_channel_setting(channel,"coupling")
     @muxchannel(mux_argnames="coupling")
     @interface.use_parameters(channel="input_channel")
-    def set_coupling(self, channel, coupling="dc"):
+    def set_coupling(self, channel, coupling="dc", verify=None):
         """
         Set channel coupling.
 
         Can be ``"ac"`` or ``"dc"``.
         """
-        self.write(":{}:COUP".format(channel),coupling)
-        return self._wip.get_coupling(channel)
+        cmds=self._ch_cmds[channel]
+        if self._need_readback(verify):
+            coupling=self.write_then_ask(cmds["coup"],coupling,cmds["coup?"])
+        else:
+            self.write(cmds["coup"],coupling)
+        return self._convert_channel_setting("coupling",coupling)
     @muxchannel
     @interface.use_parameters(channel="input_channel")
     def get_probe_attenuation(self, channel):
         """Get channel probe attenuation"""
         if not self._probe_attenuation_comm:
             return 1
-        comm,kind=self._probe_attenuation_comm
-        value=self.ask(":{}:{}?".format(channel,comm),"float")
-        return value if kind=="att" else 1./value
+        return self._ask_channel_setting(channel,"probe_attenuation")
     @muxchannel(mux_argnames="attenuation")
     @interface.use_parameters(channel="input_channel")
-    def set_probe_attenuation(self, channel, attenuation):
+    def set_probe_attenuation(self, channel, attenuation, verify=None):
         """Set channel probe attenuation"""
-        if self._probe_attenuation_comm:
-            comm,kind=self._probe_attenuation_comm
-            self.write(":{}:{}".format(channel,comm),attenuation if kind=="att" else 1./attenuation)
-        return self._wip.get_probe_attenuation(channel)
+        self._invalidate_wfmpre()
+        if not self._probe_attenuation_comm:
+            return 1
+        kind=self._probe_attenuation_comm[1]
+        cmds=self._ch_cmds[channel]
+        value=attenuation if kind=="att" else 1./attenuation
+        if self._need_readback(verify):
+            return self._convert_channel_setting("probe_attenuation",self.write_then_ask(cmds["prob"],value,cmds["prob?"],"float"))
+        self.write(cmds["prob"],value)
+        return attenuation
 
     # TODO
     def get_points_number(self, kind="acq"):
@@ -379,6 +827,7 @@ class IAgilentScope(SCPI.SCPIDevice):
         If ``reset_limits==True``, reset the datapoints range (:meth:`set_data_pts_range`) to the full range.
         The actual set value (returned by this method) can be different from the requested value.
         """
+        self._invalidate_wfmpre()
         if pts_num<=1E3:
             self._set_data_resolution("NORM")
         else:
@@ -415,6 +864,8 @@ class IAgilentScope(SCPI.SCPIDevice):
         `fmt` is a string describing the format; can be either ``"ascii"``, or a numpy-style format string (e.g., ``"<u2"``).
         If ``"default"``, use the oscilloscope default format (usually binary with smallest appropriate byte size).
         """
+        self._invalidate_wfmpre()
+        self._current_data_fmt=None
         if fmt=="default":
             fmt=self.default_data_fmt
         fmt=data_format.DataFormat.from_desc(fmt)
@@ -427,7 +878,7 @@ class IAgilentScope(SCPI.SCPIDevice):
                 self.write(":WAV:UNS", True, "bool")
             else:
                 self.write(":WAV:UNS", False, "bool")
-            if fmt.size=="1":
+            if fmt.size==1:
                 self.write(":WAV:FORM BYTE")
             else:
                 self.write(":WAV:FORM WORD")
@@ -448,7 +899,8 @@ class IAgilentScope(SCPI.SCPIDevice):
             form=self.ask(":WAV:FORM?").upper()
         
         if form.startswith("ASC"):
-            return data_format.DataFormat(None,"ascii",None)
+            self._current_data_fmt=data_format.DataFormat(None,"ascii",None)
+            return self._current_data_fmt
         elif form.startswith("WORD"):
             size=2
                     
@@ -458,46 +910,54 @@ class IAgilentScope(SCPI.SCPIDevice):
             border=">"
         else:
             border="<"
-        
-        
-        return data_format.DataFormat(size,kind,border)
+        self._current_data_fmt=data_format.DataFormat(size,kind,border)
+        return self._current_data_fmt
+    @staticmethod
+    def _is_same_data_format(fmt1, fmt2):
+        """Check if two data formats are equivalent (byte order is ignored for single-byte formats)"""
+        fmt1=data_format.DataFormat.from_desc(fmt1)
+        fmt2=data_format.DataFormat.from_desc(fmt2)
+        if fmt1.is_ascii() or fmt2.is_ascii():
+            return fmt1.is_ascii() and fmt2.is_ascii()
+        return fmt1.kind==fmt2.kind and fmt1.size==fmt2.size and (fmt1.size==1 or fmt1.byteorder==fmt2.byteorder)
 
     def _build_wfmpre(self, data):
         if len(data)<10:
             raise self.Error("incomplete preamble: {}".format(data))
-        wfmpre={}
-        wfmpre["fmt"]=('BYTE','WORD','','ASCII')
-        wfmpre["fmt"]=self.get_data_format(form=wfmpre["fmt"][int(data[0])])
-        wfmpre["type"]=('NORM','PEAK','AVER','HRES')
-        wfmpre["type"]=wfmpre["type"][int(data[1])]
-        wfmpre["pts"]=int(data[2])
-        wfmpre["count"]=int(data[3]) 
-        wfmpre["xzero"]=float(data[5])
-        wfmpre["xincr"]=float(data[4])
-        wfmpre["ptoff"]=int(data[6])
-        wfmpre["ymult"]=float(data[7])
-        wfmpre["yzero"]=float(data[8])
-        wfmpre["yoff"]=float(data[9])
-       
+        wfmpre={name:parser(v) for (name,parser),v in zip(self._wfmpre_parsers,data)}
+        wfmpre["fmt"]=self.get_data_format(form=self._wfmpre_formats.get(wfmpre["fmt"],""))
+        wfmpre["np_dtype"]=None if wfmpre["fmt"].is_ascii() else np.dtype(wfmpre["fmt"].to_desc("numpy"))
+        wfmpre["type"]=self._wfmpre_types[wfmpre["type"]]
         return wfmpre
-    def get_wfmpre(self, channel=None, enable=True):
+    def _invalidate_wfmpre(self):
+        """Clear cached preambles; called by setters which can change the scaling or the format"""
+        self._wfmpre_cache.clear()
+    def get_wfmpre(self, channel=None, enable=True, refresh=False):
         """
         Get preamble dictionary describing all scaling and format data for the given channel or a list of channels.
 
         Can be acquired once and used in subsequent multiple reads to save time on re-requesting.
         If `channel` is ``None``, use the currently selected channel.
         If ``enable==True``, make sure that the requested channel is enabled; getting preamble for disabled channels raises an error.
+        Preambles of explicitly specified channels are cached until the scaling or the format is changed using the class methods;
+        if ``refresh==True``, re-request the preamble regardless (e.g., if the settings might have been changed on the device front panel).
         """
         if isinstance(channel,(list,tuple)):
-            return {self._normalize_channel(ch):self.get_wfmpre(ch,enable=enable) for ch in channel}
+            return {self._normalize_channel(ch):self.get_wfmpre(ch,enable=enable,refresh=refresh) for ch in channel}
+        if channel is not None:
+            channel=self._normalize_channel(channel)
+            if not refresh and channel in self._wfmpre_cache:
+                return dict(self._wfmpre_cache[channel])
         self._change_channel(channel)
         if enable:
             channel=self._get_channel(channel)
             if not self.is_channel_enabled(channel):
                 self.enable_channel(channel)
-        data=self.ask(":{}?".format(self._wfmpre_comm)).split(";")
-        # data=[d.strip().upper() for d in data]
-        return self._build_wfmpre(data)
+        data=self.ask(":{}?".format(self._wfmpre_comm)).replace(",",";").split(";")  # fields can be separated either by commas or by semicolons
+        wfmpre=self._build_wfmpre(data)
+        if channel is not None:
+            self._wfmpre_cache[channel]=dict(wfmpre)
+        return wfmpre
     
     def read_raw_data(self, channel=None, fmt=None, timeout=None):
         """
@@ -524,42 +984,142 @@ class IAgilentScope(SCPI.SCPIDevice):
             data=self.read_binary_array_data(timeout=timeout)
             header=False
         return self.parse_array_data(data,fmt,include_header=header)
-    def _scale_data(self, data, wfmpre=None):
+    def _scale_data(self, data, wfmpre=None, return_mode="stacked"):
+        """
+        Scale raw data using the preamble.
+
+        If ``return_mode=="stacked"``, return 2-column float64 array with time and voltage.
+        If ``return_mode=="soa"``, return tuple ``(x0, dx, ypts)``, where ``x0`` and ``dx`` define the time axis (``x0+dx*i`` for the ``i``-th point),
+        and ``ypts`` is float32 array of voltages; this avoids building the time axis and takes 4 times less memory.
+        """
+        funcargparse.check_parameter_range(return_mode,"return_mode",["stacked","soa"])
         wfmpre=wfmpre or self.get_wfmpre()
-        xpts=(np.arange(len(data))-wfmpre["ptoff"])*wfmpre["xincr"]+wfmpre["xzero"]
-        fmt=data_format.DataFormat.from_desc(wfmpre["fmt"])
-        if fmt.is_ascii():
-            ypts=[float(x) for x in data]
+        if return_mode=="soa":
+            x0=wfmpre["xzero"]-wfmpre["ptoff"]*wfmpre["xincr"]
+            if wfmpre["np_dtype"] is None:
+                ypts=np.asarray(data,dtype=np.float32)
+            else:
+                ypts=data.astype(np.float32)
+                ypts-=np.float32(wfmpre["yoff"])
+                ypts*=np.float32(wfmpre["ymult"])
+                ypts+=np.float32(wfmpre["yzero"])
+            return x0,wfmpre["xincr"],ypts
+        trace=np.empty((len(data),2),dtype=np.float64) # columns are filled in place, which avoids temporary arrays and the final stacking copy
+        xpts,ypts=trace[:,0],trace[:,1]
+        xpts[:]=np.arange(len(data))
+        xpts-=wfmpre["ptoff"]
+        xpts*=wfmpre["xincr"]
+        xpts+=wfmpre["xzero"]
+        if wfmpre["np_dtype"] is None:
+            ypts[:]=data
         else:
-            ypts=(data-wfmpre["yoff"])*wfmpre["ymult"]+wfmpre["yzero"]
-        return np.column_stack((xpts,ypts))
+            np.subtract(data,wfmpre["yoff"],out=ypts)
+            ypts*=wfmpre["ymult"]
+            ypts+=wfmpre["yzero"]
+        return trace
     
+    def _get_raw_buffer(self, channel, wfmpre):
+        """Get the raw data buffer for the given channel, reusing the previously allocated one if it matches the preamble size and format"""
+        buffer=self._raw_buffers.get(channel)
+        if buffer is None or len(buffer)!=wfmpre["pts"] or buffer.dtype!=wfmpre["np_dtype"]:
+            buffer=self._raw_buffers[channel]=np.empty(wfmpre["pts"],dtype=wfmpre["np_dtype"])
+        return buffer
+    def _read_sweep_into(self, channel, wfmpre, out=None, timeout=None, flush_term=True):
+        """
+        Read binary sweep data directly into a preallocated array `out` and return it.
+
+        The data request should be sent beforehand. If `out` is ``None``, use the channel raw buffer (which is reused between the reads).
+        """
+        if out is None:
+            out=self._get_raw_buffer(channel,wfmpre)
+        try:
+            return self.read_binary_array_data_into(out,timeout=timeout,flush_term=flush_term)
+        except ValueError as err:
+            raise AgilentDataLengthError(str(err)) from err
+    def _read_sweep_ascii(self, wfmpre, timeout=None):
+        """
+        Read ASCII sweep data and return it as a float32 array.
+
+        The data request should be sent beforehand.
+        """
+        data=self.read("raw",timeout=timeout)
+        if data[:1]==b"#":
+            data=data[2+int(data[1:2]):]
+        return _parse_ascii_data(data,wfmpre["pts"])
     @interface.use_parameters(channel="input_channel")
-    def _read_sweep_fast(self, channel, wfmpre=None, timeout=None):
+    def _read_sweep_fast(self, channel, wfmpre=None, timeout=None, return_mode="stacked"):
         self.write(":WAV:SOUR {}".format(channel))
         wfmpre=wfmpre or self.get_wfmpre(enable=False)
         self.write("WAV:DATA?")
-        if wfmpre["fmt"].is_ascii():
-            data=self.read("raw",timeout=timeout)
-            header=True
+        if wfmpre["np_dtype"] is None:
+            trace=self._read_sweep_ascii(wfmpre,timeout=timeout)
         else:
-            data=self.read_binary_array_data(timeout=timeout)
-            header=False
-        trace=self.parse_array_data(data,wfmpre["fmt"].to_desc(),include_header=header)
+            trace=self._read_sweep_into(channel,wfmpre,timeout=timeout)
         if len(trace)!=wfmpre["pts"]:
-            raise AgilentError("received data length {0} is not equal to the number of points {1}".format(len(trace),wfmpre["pts"]))
-        return self._scale_data(trace,wfmpre)
-    def read_multiple_sweeps(self, channels, wfmpres=None, ensure_fmt=False, timeout=None, return_wfmpres=None):
+            raise AgilentDataLengthError("received data length {0} is not equal to the number of points {1}".format(len(trace),wfmpre["pts"]))
+        return self._scale_data(trace,wfmpre,return_mode=return_mode)
+    def _skip_data_blocks(self, nblocks, timeout=None):
+        """
+        Skip `nblocks` following binary data blocks of a compound reply (each preceded by a ``";"`` separator) along with the final terminator.
+
+        Each block is skipped according to its declared length, so the blocks which are still being prepared by the device are waited for;
+        if the reply is malformed, everything available is flushed instead.
+        """
+        try:
+            for _ in range(nblocks):
+                sep=self._read_retry(raw=True,size=1,timeout=timeout)
+                if sep!=b";":
+                    raise AgilentError("unexpected separator between data blocks: {}".format(sep))
+                self.read_binary_array_data(timeout=timeout,flush_term=False)
+        except (comm_backend.DeviceError,ValueError):
+            self.flush()
+        else:
+            self.flush(one_line=True)
+    def _read_sweeps_pipelined(self, channels, wfmpres, timeout=None, return_mode="stacked"):
+        """
+        Read binary sweeps from several channels using a single compound request.
+
+        All ``:WAV:SOUR``/``:WAV:DATA?`` pairs are sent in one message, so the device prepares the next block while the previous one is being transferred;
+        the replies are then read in order (they are separated by ``";"``, and the whole message is terminated by a newline).
+        If any of the blocks has an unexpected length, the remaining blocks are skipped (see :meth:`_skip_data_blocks`) before re-raising the error;
+        on other errors the rest of the reply is flushed, so that the following requests are not affected.
+        """
+        self.write(";".join([":WAV:SOUR {};:WAV:DATA?".format(ch) for ch in channels]))
+        sweeps=[]
+        for i,ch in enumerate(channels):
+            wfmpre=wfmpres[ch]
+            try:
+                trace=self._read_sweep_into(ch,wfmpre,timeout=timeout,flush_term=False)
+                if i<len(channels)-1:
+                    sep=self._read_retry(raw=True,size=1,timeout=timeout)
+                    if sep!=b";":
+                        raise AgilentError("unexpected separator between data blocks: {}".format(sep))
+            except AgilentDataLengthError:
+                self._skip_data_blocks(len(channels)-i-1,timeout=timeout)
+                raise
+            except Exception:
+                self.flush()
+                raise
+            if i==len(channels)-1:
+                self.flush(one_line=True)
+            sweeps.append(self._scale_data(trace,wfmpre,return_mode=return_mode))
+        return sweeps
+    def read_multiple_sweeps(self, channels, wfmpres=None, ensure_fmt=False, timeout=None, return_wfmpres=None, return_mode="stacked"):
         """
         Read data from a multiple channels channel.
 
         Args:
             channels: list of channel indices or names
             wfmpres: optional list or dictionary of preambles (obtained using :meth:`get_wfmpre`);
-                if it is ``None``, obtain during reading, which slows down the data acquisition a bit
+                missing preambles are obtained using :meth:`get_wfmpre`, so they are only requested on the first read and then cached
+                until the scaling, timebase, acquisition, or format settings are changed using the class methods or :meth:`write` (or :meth:`reset` is called);
+                if the received data length does not agree with a cached preamble (e.g., the number of points has changed), the preamble is re-requested and the read is repeated;
+                changes made from the front panel are not detected, so in this case call ``get_wfmpre(channels,refresh=True)`` before reading to get up-to-date preambles
             ensure_fmt: if ``True``, make sure that oscilloscope data format agrees with the one in `wfmpre`
             timeout: read timeout
             return_wfmpres: if ``True``, return tuple ``(sweeps, wfmpres)``, where ``wfmpres`` can be used for further sweep readouts.
+            return_mode: sweep representation; can be ``"stacked"`` (2-column array with time and voltage),
+                or ``"soa"`` (tuple ``(x0, dx, ypts)`` with the time axis start and step, and float32 voltage array)
         """
         if not channels:
             return []
@@ -571,25 +1131,146 @@ class IAgilentScope(SCPI.SCPIDevice):
         if ensure_fmt:
             pre=wfmpres.get(channels[0],None)
             fmt=pre["fmt"] if pre else self.default_data_fmt
-            if self.get_data_format()!=data_format.DataFormat.from_desc(fmt).to_desc():
+            current_fmt=self._current_data_fmt or self.get_data_format()
+            if not self._is_same_data_format(current_fmt,fmt):
                 self.set_data_format(fmt=fmt)
-        for ch in channels:
-            if ch not in wfmpres:
-                wfmpres[ch]=self.get_wfmpre(ch,enable=False)
-        sweeps=[self._read_sweep_fast(ch,wfmpres[ch],timeout=timeout) for ch in channels]
+        cached=[ch for ch in channels if wfmpres.get(ch) is None]
+        for ch in cached:
+            wfmpres[ch]=self.get_wfmpre(ch,enable=False)
+        try:
+            sweeps=self._read_sweeps(channels,wfmpres,timeout=timeout,return_mode=return_mode)
+        except AgilentDataLengthError:
+            if not cached:
+                raise
+            for ch in cached:
+                wfmpres[ch]=self.get_wfmpre(ch,enable=False,refresh=True)
+            sweeps=self._read_sweeps(channels,wfmpres,timeout=timeout,return_mode=return_mode)
         return (sweeps,wfmpres) if return_wfmpres else sweeps
-    def read_sweep(self, channel, wfmpre=None, ensure_fmt=True, timeout=None):
+    def _read_sweeps(self, channels, wfmpres, timeout=None, return_mode="stacked"):
+        """Read sweeps for the given channels using the given preambles"""
+        if any(wfmpres[ch]["np_dtype"] is None for ch in channels):
+            return [self._read_sweep_fast(ch,wfmpres[ch],timeout=timeout,return_mode=return_mode) for ch in channels]
+        return self._read_sweeps_pipelined(channels,wfmpres,timeout=timeout,return_mode=return_mode)
+    def read_sweep(self, channel, wfmpre=None, ensure_fmt=True, timeout=None, return_mode="stacked"):
         """
         Read data from a single channel.
 
         Args:
             channel: channel index or name
             wfmpre: optional preamble dictionary (obtained using :meth:`get_wfmpre`);
-                if it is ``None``, obtain during reading, which slows down the data acquisition a bit
+                if it is ``None``, use the cached preamble (requested on the first read; see :meth:`read_multiple_sweeps` for details);
+                if the settings have been changed from the front panel, call ``get_wfmpre(channel,refresh=True)`` before reading to update the cache
             ensure_fmt: if ``True``, make sure that oscilloscope data format agrees with the one in `wfmpre`
             timeout: read timeout
+            return_mode: sweep representation; can be ``"stacked"`` (2-column array with time and voltage),
+                or ``"soa"`` (tuple ``(x0, dx, ypts)`` with the time axis start and step, and float32 voltage array)
+        """
+        return self.read_multiple_sweeps([channel],[wfmpre],ensure_fmt=ensure_fmt,timeout=timeout,return_mode=return_mode)[0]
+
+    class AcquisitionPipeline:
+        """
+        Background acquisition loop.
+
+        Repeatedly starts a single acquisition, waits for it to complete, reads the sweeps, and puts them into a queue,
+        so that the next acquisition and readout proceed while the previous sweeps are being processed.
+        If an error is raised in the loop, it is put into the queue and re-raised on the next :meth:`get` call.
+        """
+        def __init__(self, device, channels, software_trigger=False, wait_timeout=None, timeout=None, return_mode="stacked", queue_size=2):
+            self.device=device
+            self.channels=channels
+            self.software_trigger=software_trigger
+            self.wait_timeout=wait_timeout
+            self.timeout=timeout
+            self.return_mode=return_mode
+            self.queue=queue.Queue(maxsize=queue_size)
+            self.stop_evt=threading.Event()
+            self.thread=threading.Thread(target=self._run,daemon=True)
+        def start(self):
+            """Start the loop"""
+            self.thread.start()
+        def _put(self, item):
+            while not self.stop_evt.is_set():
+                try:
+                    self.queue.put(item,timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        def _wait_acquisition(self):
+            """
+            Wait until the acquisition is complete by polling the acquisition state (see :meth:`IAgilentScope.is_running`).
+
+            If the loop is stopped in the meantime, abort the acquisition and return ``False``; otherwise, return ``True``.
+            """
+            device=self.device
+            ctd=general.Countdown(device._wait_sync_timeout if self.wait_timeout is None else self.wait_timeout)
+            while device.is_running():
+                if self.stop_evt.is_set():
+                    device.stop_grabbing()
+                    return False
+                if ctd.passed():
+                    raise AgilentError("timeout while waiting for the acquisition to complete")
+                self.stop_evt.wait(device._default_poll_interval)
+            return True
+        def _run(self):
+            try:
+                while not self.stop_evt.is_set():
+                    self.device.grab_single(wait=False,software_trigger=self.software_trigger)
+                    if not self._wait_acquisition():
+                        break
+                    sweeps=self.device.read_multiple_sweeps(self.channels,ensure_fmt=False,timeout=self.timeout,return_mode=self.return_mode)
+                    self._put(sweeps)
+            except Exception as e:  # pylint: disable=broad-except
+                self._put(e)
+        def get(self, timeout=None):
+            """Get the next list of sweeps, waiting for at most `timeout` seconds (``None`` means waiting forever)"""
+            while True:
+                if not self.thread.is_alive() and self.queue.empty():
+                    raise AgilentError("acquisition pipeline is not running")
+                try:
+                    item=self.queue.get(timeout=0.1 if timeout is None else timeout)
+                    break
+                except queue.Empty:
+                    if timeout is not None:
+                        raise AgilentError("timeout while waiting for the next sweep") from None
+            if isinstance(item,Exception):
+                raise item
+            return item
+        def stop(self):
+            """Stop the loop; the current acquisition is aborted, but the readout (if it is already in progress) is completed"""
+            self.stop_evt.set()
+            self.thread.join()
+    def start_pipeline(self, channels, software_trigger=False, wait_timeout=None, timeout=None, return_mode="stacked", queue_size=2):
+        """
+        Start background acquisition of sweeps from the given channels.
+
+        Single acquisitions are started and read out in a separate thread, overlapping with the processing of the previous sweeps.
+        The preambles are requested on start and then taken from the cache (and re-requested if the number of points changes),
+        so the settings should not be changed while the pipeline is running; other device methods should also not be called until the pipeline is stopped using :meth:`stop_pipeline`.
+        Sweeps are read using :meth:`next_sweep`; at most `queue_size` sweeps lists are stored, after which the acquisition is paused until they are read.
+        `software_trigger` is passed to :meth:`grab_single`, and `wait_timeout` is the acquisition timeout (by default, same as in :meth:`wait_for_grabbing`);
+        acquisition completion is checked by polling (see :meth:`wait_for_grabbing`), so that the pipeline can be stopped while waiting for a trigger.
+        `timeout` and `return_mode` are passed to :meth:`read_multiple_sweeps`.
+        """
+        self.stop_pipeline()
+        channels=[self._normalize_channel(ch) for ch in channels]
+        self.get_wfmpre(channels)  # enable the channels and fill the preamble cache
+        self._pipeline=self.AcquisitionPipeline(self,channels,software_trigger=software_trigger,wait_timeout=wait_timeout,
+            timeout=timeout,return_mode=return_mode,queue_size=queue_size)
+        self._pipeline.start()
+    def next_sweep(self, timeout=None):
+        """
+        Get the next list of sweeps acquired by the pipeline started with :meth:`start_pipeline`.
+
+        Wait for at most `timeout` seconds (``None`` means waiting forever).
         """
-        return self.read_multiple_sweeps([channel],[wfmpre],ensure_fmt=ensure_fmt,timeout=timeout)[0]
+        if self._pipeline is None:
+            raise AgilentError("acquisition pipeline is not running")
+        return self._pipeline.get(timeout=timeout)
+    def stop_pipeline(self):
+        """Stop the acquisition pipeline started with :meth:`start_pipeline` (aborts the current acquisition and waits until the current readout is complete)"""
+        if self._pipeline is not None:
+            self._pipeline.stop()
+            self._pipeline=None
 
 
 
@@ -608,6 +1289,7 @@ class DSO2000(IAgilentScope):
     Args:
         addr: device address; usually a VISA address string such as ``"USB0::0x0699::0x0364::C000000::INSTR"``
         nchannels: can specify number of channels on the oscilloscope; by default, autodetect number of channels (might take several seconds on connection)
+        tcp_nodelay: if ``True`` and the device is connected via network, disable Nagle's algorithm on the connection, which reduces latency of short commands
     """
 
 class MSO2000(IAgilentScope):
@@ -621,5 +1303,6 @@ class MSO2000(IAgilentScope):
     Args:
         addr: device address; usually a VISA address string such as ``"USB0::0x0699::0x0364::C000000::INSTR"``
         nchannels: can specify number of channels on the oscilloscope; by default, autodetect number of channels (might take several seconds on connection)
+        tcp_nodelay: if ``True`` and the device is connected via network, disable Nagle's algorithm on the connection, which reduces latency of short commands
     """
     # TODO add stuff for digital channels
\ No newline at end of file
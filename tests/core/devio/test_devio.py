@@ -0,0 +1,136 @@
+import pytest
+
+import numpy as np
+import socket
+import threading
+import time
+
+from pylablib.core.utils import net
+from pylablib.core.devio import comm_backend, SCPI
+
+
+
+##### Loopback server #####
+
+@pytest.fixture
+def loopback():
+    """Function which starts a local server sending the given chunks (with a delay between them) to the first client, and returns the server address"""
+    servers=[]
+    def _start(chunks, delay=10E-3):
+        srv=socket.socket()
+        srv.bind(("127.0.0.1",0))
+        srv.listen(1)
+        def _serve():
+            conn,_=srv.accept()
+            with conn:
+                for c in chunks:
+                    conn.sendall(c)
+                    time.sleep(delay)
+                conn.settimeout(1.)
+                try:
+                    conn.recv(1)  # wait until the client closes the connection
+                except OSError:
+                    pass
+        thread=threading.Thread(target=_serve,daemon=True)
+        thread.start()
+        servers.append((srv,thread))
+        return "127.0.0.1:{}".format(srv.getsockname()[1])
+    yield _start
+    for srv,thread in servers:
+        srv.close()
+        thread.join(2.)
+
+class NoReadIntoBackend(comm_backend.NetworkDeviceBackend):
+    """Network backend which does not support reading into a buffer"""
+    @property
+    def read_into(self):
+        raise AttributeError("read_into")
+
+
+
+
+##### Socket tests #####
+
+def test_recv_fixedlen_into(loopback):
+    """Test receiving data split into several chunks directly into a buffer"""
+    data=bytes(range(256))*4
+    addr=loopback([data[:1],data[1:100],data[100:600],data[600:]])
+    sock=net.ClientSocket(timeout=2.,send_method="fixedlen",recv_method="fixedlen")
+    nrecv=[]
+    recv_into_wait=sock._recv_into_wait
+    def _recv_into_wait(buf):
+        nrecv.append(recv_into_wait(buf))
+        return nrecv[-1]
+    sock._recv_into_wait=_recv_into_wait
+    try:
+        host,port=addr.split(":")
+        sock.connect(host,int(port))
+        out=np.zeros(len(data)//2,dtype="<u2")
+        assert sock.recv_fixedlen_into(out)==len(data)
+        assert out.tobytes()==data
+        assert len(nrecv)>1
+        assert sum(nrecv)==len(data)
+    finally:
+        sock.close()
+
+def test_backend_read_into(loopback, monkeypatch):
+    """Test network backend reading into a buffer and logging the read data"""
+    data=bytes(range(100))
+    addr=loopback([data[:30],data[30:],data[::-1]])
+    log=[]
+    class Logger:
+        def log(self, operation, value):
+            log.append((operation,value))
+    monkeypatch.setattr(comm_backend,"logger",Logger())
+    backend=comm_backend.NetworkDeviceBackend(addr,timeout=2.)
+    try:
+        buf=bytearray(len(data))
+        assert backend.read_into(buf)==len(data)
+        assert bytes(buf)==data
+        assert backend.read_into(buf)==len(data)
+        assert bytes(buf)==data[::-1]
+        assert log==[("read",data),("read",data[::-1])]
+    finally:
+        backend.close()
+
+
+
+
+##### SCPI binary data tests #####
+
+@pytest.fixture(params=[comm_backend.NetworkDeviceBackend,NoReadIntoBackend])
+def scpi_opener(request):
+    """Function which opens a SCPI device with the given address using either a buffer-reading or a generic network backend"""
+    devices=[]
+    def _open(addr):
+        backend=request.param(addr,timeout=2.,term_write="\n",term_read="\n")
+        devices.append(SCPI.SCPIDevice(backend))
+        return devices[-1]
+    yield _open
+    for dev in devices:
+        dev.close()
+
+def test_read_binary_array_data_into(loopback, scpi_opener):
+    """Test reading binary data blocks split into several chunks directly into a buffer"""
+    data=np.arange(500,dtype="<i2")
+    block=b"#41000"+data.tobytes()+b"\n"
+    dev=scpi_opener(loopback([block[:3],block[3:100],block[100:],b"#14abcd\n"]))
+    out=np.zeros(500,dtype="<i2")
+    assert dev.read_binary_array_data_into(out) is out
+    assert np.array_equal(out,data)
+    assert dev.read_binary_array_data()==b"abcd"
+
+def test_read_binary_array_data_into_mismatch(loopback, scpi_opener):
+    """Test skipping a binary data block with a wrong length"""
+    reply=b"#210"+bytes(range(10))+b";#14abcd;#15efghi\n"
+    dev=scpi_opener(loopback([reply[:8],reply[8:20],reply[20:],b"#11x\n"]))
+    with pytest.raises(ValueError):
+        dev.read_binary_array_data_into(np.zeros(8,dtype="u1"),flush_term=False)
+    assert dev.instr.read(1)==b";"
+    out=np.zeros(4,dtype="u1")
+    dev.read_binary_array_data_into(out,flush_term=False)
+    assert out.tobytes()==b"abcd"
+    assert dev.instr.read(1)==b";"
+    with pytest.raises(ValueError):
+        dev.read_binary_array_data_into(np.zeros(4,dtype="u1"))
+    assert dev.read_binary_array_data()==b"x"
@@ -0,0 +1,62 @@
+import pytest
+
+import numpy as np
+
+from pylablib.devices.Agilent import base
+from pylablib.core.devio import data_format
+
+
+
+##### ASCII waveform parsing tests #####
+
+@pytest.fixture(params=["numba","fallback"])
+def ascii_parser(request, monkeypatch):
+    """ASCII data parser using either Numba kernel or the generic conversion"""
+    if request.param=="numba":
+        if base._parse_ascii_numba is None:
+            pytest.skip("numba is not available")
+    else:
+        monkeypatch.setattr(base,"_parse_ascii_numba",None)
+    return base._parse_ascii_data
+
+ascii_samples=[b"1.5E-01,-2,+3.25e+2", b"1,2,3,", b",1,,2,3", b" 1 , 2 ,3\n", b"+1.2E+00\t,-4.5e-03,\r\n", b".5,-.25e1,7.",
+               b"1,2 3\n4", b"1,nan,3", b"1,inf,-inf", b"1.00000000000000000001,123456789012345678901234567890", b""]
+@pytest.mark.parametrize("data",ascii_samples)
+def test_ascii_parsing(ascii_parser, data):
+    """Test ASCII data parsing consistency with the generic conversion"""
+    expected=data_format.DataFormat.from_desc("ascii").convert_from_str(data).astype(np.float32)
+    for npts in [len(expected),None]:
+        parsed=ascii_parser(data,npts)
+        assert parsed.dtype==np.float32
+        assert np.array_equal(parsed,expected,equal_nan=True)
+
+@pytest.mark.parametrize("data",[b"1,abc,3", b"1,2x,3", b"1,-,3", b"1,2e,3", b"1,1.5.2", b"1,2-3"])
+def test_ascii_parsing_errors(ascii_parser, data):
+    """Test ASCII data parsing errors on invalid values"""
+    with pytest.raises(ValueError):
+        ascii_parser(data,3)
+
+def test_ascii_parsing_length(ascii_parser):
+    """Test that all values are returned if the data is longer or shorter than the expected number of points"""
+    data=",".join(["{:E}".format(v) for v in np.arange(20)*0.5]).encode()
+    for npts in [1,5,19,20,21,100]:
+        parsed=ascii_parser(data,npts)
+        assert len(parsed)==20
+        assert np.array_equal(parsed,np.arange(20,dtype=np.float32)*0.5)
+
+def test_ascii_numba_kernel():
+    """Test that Numba kernel parses plain decimal numbers by itself and reports non-decimal values"""
+    if base._parse_ascii_numba is None:
+        pytest.skip("numba is not available")
+    for data in ascii_samples:
+        out=np.empty(100,dtype=np.float32)
+        n=base._parse_ascii_numba(np.frombuffer(data,dtype="u1"),out)
+        if b"n" in data:
+            assert n==-1
+        else:
+            expected=data_format.DataFormat.from_desc("ascii").convert_from_str(data).astype(np.float32)
+            assert n==len(expected)
+            assert np.array_equal(out[:n],expected)
+    out=np.empty(2,dtype=np.float32)
+    assert base._parse_ascii_numba(np.frombuffer(b"1,2,3,4",dtype="u1"),out)==4
+    assert np.array_equal(out,[1,2])